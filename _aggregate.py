@@ -0,0 +1,389 @@
+import os
+import re
+import json
+import glob
+import mmap
+import atexit
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
+from io import StringIO
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# ---- CONFIG ----
+BASE_FOLDER = './grade_generalised'
+FAILED_FILES_LOG = 'failed_files.log'
+
+# Per-sample files are independent, so reads overlap across a thread pool
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Only these MAF columns feed the summaries; everything else is dropped at parse time
+MAF_COLUMNS = ['Hugo_Symbol', 'Variant_Classification']
+
+# Gene symbols and variant classes are small vocabularies, so they are parsed
+# dictionary-encoded (pandas 'category') instead of as one string per row
+MAF_COLUMN_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+# Segment means are log2 ratios; float32 halves the CNV accumulator without losing anything useful
+CNV_COLUMN_TYPE = pa.float32()
+
+# Parsed columns are cached next to each source file as <file>.feather, stamped with
+# CACHE_VERSION; bump it whenever the cached columns, dtypes or per-stage results change
+CACHE_VERSION = 'v5'
+CACHE_SUFFIXES = ('.feather', '.feather.tmp')
+
+# Classifies a sample file name in one scan; a 'Copy...' match means CNV, anything else SNV
+_DISPATCH = re.compile(r'Copy_Number_Variation|Simple_Nucleotide_Variation|\.maf$')
+
+# Aggregated per-stage results are pickled here, keyed on the stage's file mtimes
+STAGE_CACHE_DIR = '.cache'
+
+# ---- File Readers ----
+def _read_header(file_path):
+    with open(file_path, 'r') as f:
+        return f.readline().rstrip('\r\n').split('\t')
+
+def _scan_comment_lines(file_path):
+    # (number of leading '#' lines, whether any '#' line follows the header),
+    # scanned on the raw bytes instead of decoding every line
+    if os.path.getsize(file_path) == 0:
+        return 0, False
+    count = 0
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = 0
+        while mm[pos:pos + 1] == b'#':
+            count += 1
+            next_pos = mm.find(b'\n', pos) + 1
+            if next_pos == 0:
+                return count, False
+            pos = next_pos
+        return count, mm.find(b'\n#', pos) != -1
+
+def count_comment_lines(file_path):
+    return _scan_comment_lines(file_path)[0]
+
+def _cache_stamp(file_path, cols):
+    # Exact identity of the source, like the stage signature; an older mtime still counts as a change.
+    # The requested projection is part of it, so a read with other columns re-parses the file.
+    stat = os.stat(file_path)
+    return {
+        b'cache_version': CACHE_VERSION.encode(),
+        b'source_mtime_ns': str(stat.st_mtime_ns).encode(),
+        b'source_size': str(stat.st_size).encode(),
+        b'columns': json.dumps(cols).encode(),
+    }
+
+def _remove_legacy_caches(file_path):
+    # Earlier releases put the version in the name (<file>.v1.feather, ...); nothing else cleans those up
+    for suffix in CACHE_SUFFIXES:
+        for legacy_path in glob.glob(f'{glob.escape(file_path)}.v[0-9]*{suffix}'):
+            try:
+                os.remove(legacy_path)
+            except OSError:
+                pass
+
+def _cached_read(file_path, loader, cols=None):
+    cache_path = f'{file_path}.feather'
+    stamp = _cache_stamp(file_path, cols)
+    if os.path.exists(cache_path):
+        try:
+            with pa.OSFile(cache_path, 'rb') as source:
+                reader = pa.ipc.open_file(source)
+                metadata = reader.schema.metadata or {}
+                if all(metadata.get(key) == value for key, value in stamp.items()):
+                    return reader.read_all()
+        except (OSError, pa.ArrowInvalid):
+            # Unreadable cache files are simply rebuilt below
+            pass
+
+    table = loader()
+    if cols is not None:
+        table = table.select(cols)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), **stamp})
+
+    # Write to a temp name first so an interrupted run never leaves a truncated cache behind
+    tmp_path = f'{cache_path}.tmp'
+    try:
+        feather.write_feather(table, tmp_path, compression='lz4')
+        os.replace(tmp_path, cache_path)
+        _remove_legacy_caches(file_path)
+    except (OSError, ValueError):
+        # Read-only data folders or unusual headers just go uncached
+        pass
+    return table
+
+def _load_cnv_file(file_path, columns):
+    if columns is None:
+        header = _read_header(file_path)
+        segment_col = get_segment_mean_column(header)
+        if segment_col is None:
+            return pa.schema([(name, pa.null()) for name in header]).empty_table()
+        columns = [segment_col]
+
+    table = pacsv.read_csv(
+        file_path,
+        parse_options=pacsv.ParseOptions(delimiter='\t'),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=columns,
+            column_types={col: CNV_COLUMN_TYPE for col in columns},
+        ),
+    )
+    return table
+
+def _load_irregular_maf_file(file_path, columns):
+    # Same parse as before the Arrow reader: drop every '#' line, then let pandas pad
+    # rows with missing trailing fields with NaN. Only used for files Arrow can't take as-is.
+    with open(file_path, 'r') as f:
+        lines = [line for line in f if not line.startswith('#')]
+    maf_df = pd.read_csv(StringIO(''.join(lines)), sep='\t', usecols=columns, dtype=str)
+    return pa.table({
+        col: pc.dictionary_encode(pa.array(maf_df[col], type=pa.string(), from_pandas=True))
+        for col in columns
+    })
+
+def _load_maf_file(file_path, columns):
+    skip_rows, has_body_comments = _scan_comment_lines(file_path)
+    if has_body_comments:
+        return _load_irregular_maf_file(file_path, columns)
+
+    try:
+        table = pacsv.read_csv(
+            file_path,
+            read_options=pacsv.ReadOptions(skip_rows=skip_rows),
+            parse_options=pacsv.ParseOptions(delimiter='\t'),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=columns,
+                column_types={col: MAF_COLUMN_TYPE for col in columns},
+                strings_can_be_null=True,
+            ),
+        )
+    except pa.ArrowInvalid:
+        # Ragged rows (e.g. truncated trailing fields); anything pandas rejects too still fails the file
+        return _load_irregular_maf_file(file_path, columns)
+
+    # Each parsed block gets its own dictionary; Feather needs a single one per column
+    return table.unify_dictionaries()
+
+def read_cnv_file(file_path, columns=None):
+    try:
+        return _cached_read(file_path, lambda: _load_cnv_file(file_path, columns), columns)
+    except Exception as e:
+        print(f"❌ Failed to read CNV file {file_path}: {e}")
+        return None
+
+def read_maf_file(file_path, columns=MAF_COLUMNS):
+    try:
+        return _cached_read(file_path, lambda: _load_maf_file(file_path, columns), columns)
+    except Exception as e:
+        print(f"❌ Failed to read MAF file {file_path}: {e}")
+        return None
+
+# ---- Helper Function to Count Column Values ----
+def count_values(column):
+    # Hash aggregate runs in Arrow; only the distinct values become Python objects
+    counts = pc.value_counts(pc.drop_null(column))
+    return Counter(dict(zip(counts.field('values').to_pylist(), counts.field('counts').to_pylist())))
+
+def ranked_counts(counter, n=None):
+    # Highest count first, ties broken by name so reports don't depend on merge order
+    ranked = sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+    return ranked if n is None else ranked[:n]
+
+# ---- Helper Function to Find Segment Mean Column ----
+_SEGMENT_KEYS = ('segment_mean', 'segmentmean')
+
+def get_segment_mean_column(columns):
+    # Reversed so the first column wins if two only differ by case
+    lowered = {col.lower(): col for col in reversed(columns)}
+    return next((lowered[key] for key in _SEGMENT_KEYS if key in lowered), None)
+
+# ---- Read One Sample File ----
+def _read_one(task):
+    kind, file_path = task
+
+    if kind == 'cnv':
+        cnv_table = read_cnv_file(file_path)
+        if cnv_table is None:
+            return ('read_failed', file_path, "Failed to read CNV file")
+        segment_col = get_segment_mean_column(cnv_table.column_names)
+        if not segment_col:
+            return ('cnv_missing', file_path)
+        return ('cnv', cnv_table.column(segment_col).to_numpy())
+
+    snp_table = read_maf_file(file_path)
+    if snp_table is None:
+        return ('read_failed', file_path, "Failed to read MAF file")
+    return ('snp', count_values(snp_table.column('Hugo_Symbol')), count_values(snp_table.column('Variant_Classification')))
+
+# ---- List One Stage's Sample Files ----
+def _collect_tasks(stage_folder):
+    tasks = []
+    for sample_entry in os.scandir(stage_folder):
+        if not sample_entry.is_dir():
+            continue
+
+        print(f"📂 Processing sample: {sample_entry.name}")
+
+        for file_entry in os.scandir(sample_entry.path):
+            file = file_entry.name
+            if file.endswith(CACHE_SUFFIXES):
+                continue
+
+            match = _DISPATCH.search(file)
+            if not match:
+                continue
+
+            kind = 'cnv' if match.group(0).startswith('Copy') else 'snp'
+            tasks.append((kind, file_entry.path))
+
+    return tasks
+
+def _stage_signature(tasks):
+    # Any added, removed or modified input file (or a CACHE_VERSION bump) changes the key
+    digest = hashlib.blake2b(CACHE_VERSION.encode())
+    for file_path in sorted(task[1] for task in tasks):
+        stat = os.stat(file_path)
+        digest.update(f"{file_path}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+    return digest.hexdigest()
+
+def _remove_stale_stage_caches(stage, cache_path):
+    # Every input change gets a new signature; only the current pickle is worth keeping.
+    # The hex check keeps stage 'I' from touching the pickles of a stage named 'I.A'.
+    prefix = os.path.join(STAGE_CACHE_DIR, f'{stage}.')
+    for stale_path in glob.glob(f'{glob.escape(prefix)}*.pkl'):
+        signature = stale_path[len(prefix):-len('.pkl')]
+        if stale_path == cache_path or not re.fullmatch(r'[0-9a-f]+', signature):
+            continue
+        try:
+            os.remove(stale_path)
+        except OSError:
+            pass
+
+def _concat_segment_means(arrays):
+    return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.float32)
+
+def describe_segment_means(cnv_arr):
+    # Stats of the stored float32 values, accumulated in float64; they match a float64
+    # read only to float32 precision (about 7 significant digits)
+    return pd.Series(cnv_arr, dtype='float64').describe()
+
+# ---- Process One Stage ----
+def process_stage(stage, stage_folder):
+    tasks = _collect_tasks(stage_folder)
+
+    cache_path = os.path.join(STAGE_CACHE_DIR, f'{stage}.{_stage_signature(tasks)}.pkl')
+    if os.path.exists(cache_path):
+        print(f"♻️ Reusing cached results for stage {stage}")
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+
+    cnv_arrays = []
+    read_failed = False
+    stage_data = {
+        'gene_counter': Counter(),
+        'class_counter': Counter(),
+        'failed_files': [],
+    }
+
+    # Results are merged here on the main thread in task order, so the accumulators
+    # need no lock and the merge is the same on every run
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for result in executor.map(_read_one, tasks):
+            if result[0] == 'cnv':
+                cnv_arrays.append(result[1])
+            elif result[0] == 'read_failed':
+                read_failed = True
+                stage_data['failed_files'].append((result[1], result[2]))
+            elif result[0] == 'cnv_missing':
+                print(f"⚠️ Warning: No Segment Mean column found in {result[1]}.")
+                stage_data['failed_files'].append((result[1], "Missing Segment Mean column"))
+            else:
+                stage_data['gene_counter'].update(result[1])
+                stage_data['class_counter'].update(result[2])
+
+    stage_data['cnv_arr'] = _concat_segment_means(cnv_arrays)
+
+    # A read error may be transient (locked or half-copied file), so such a stage is
+    # never cached; the next run retries instead of silently reusing the gap
+    if read_failed:
+        return stage_data
+
+    # Same write-then-rename as the per-file Feather cache
+    tmp_path = f'{cache_path}.tmp'
+    try:
+        os.makedirs(STAGE_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(stage_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        return stage_data
+
+    _remove_stale_stage_caches(stage, cache_path)
+    return stage_data
+
+# ---- Logging ----
+# One buffered handle for the whole run instead of an open/close per failure
+_FAIL_LOG = None
+
+def _close_failed_files_log():
+    global _FAIL_LOG
+    if _FAIL_LOG is not None:
+        _FAIL_LOG.close()
+        _FAIL_LOG = None
+
+atexit.register(_close_failed_files_log)
+
+def open_failed_files_log():
+    # Each run starts a fresh log; the previous run's handle is closed before truncating
+    global _FAIL_LOG
+    _close_failed_files_log()
+    _FAIL_LOG = open(FAILED_FILES_LOG, 'w', buffering=1 << 20)
+
+def log_failed_file(file_path, reason):
+    if _FAIL_LOG is None:
+        open_failed_files_log()
+    _FAIL_LOG.write(f"{file_path}\t{reason}\n")
+
+# ---- Aggregate All Stages ----
+def aggregate_all(base_folder=BASE_FOLDER):
+    # One walk + parse feeds both the per-stage and the overall reports
+    stages = {}
+
+    # Start a fresh failed file log
+    open_failed_files_log()
+
+    for stage_entry in os.scandir(base_folder):
+        if not stage_entry.is_dir():
+            continue
+        stage, stage_folder = stage_entry.name, stage_entry.path
+
+        print(f"\n🧬 Processing Stage: {stage}")
+        stage_data = process_stage(stage, stage_folder)
+
+        # Failures are kept with the stage results so cached runs still report them
+        for file_path, reason in stage_data['failed_files']:
+            log_failed_file(file_path, reason)
+
+        stages[stage] = stage_data
+
+    _FAIL_LOG.flush()
+    return stages
+
+def combine_stages(stages):
+    # Rolled up only on demand, so per-stage reports never pay for a second copy of the CNV data
+    gene_counter, class_counter = Counter(), Counter()
+    for stage_data in stages.values():
+        gene_counter.update(stage_data['gene_counter'])
+        class_counter.update(stage_data['class_counter'])
+
+    return {
+        'cnv_arr': _concat_segment_means([data['cnv_arr'] for data in stages.values() if data['cnv_arr'].size]),
+        'gene_counter': gene_counter,
+        'class_counter': class_counter,
+    }
@@ -0,0 +1,50 @@
+import math
+import pandas as pd
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# ---- Sheet Rows ----
+def _cell_value(value):
+    # Same conventions as DataFrame.to_excel: NaN becomes a blank cell and
+    # infinities are written as 'inf' / '-inf' (neither writer accepts them as numbers)
+    if pd.isna(value):
+        return None
+    if isinstance(value, float) and math.isinf(value):
+        return 'inf' if value > 0 else '-inf'
+    return value
+
+def _sheet_rows(df):
+    # The summary tables are tiny, so rows are written directly instead of
+    # through pandas' per-cell formatter
+    yield [df.index.name or ''] + list(df.columns)
+    for row in df.itertuples(index=True):
+        yield [_cell_value(value) for value in row]
+
+# ---- Write Workbook ----
+def write_workbook(output_path, sheets):
+    if xlsxwriter is not None:
+        # Rows go top-to-bottom, which is what constant_memory mode requires
+        workbook = xlsxwriter.Workbook(output_path, {'constant_memory': True})
+        try:
+            for sheet_title, df in sheets:
+                worksheet = workbook.add_worksheet(sheet_title)
+                for row_num, row in enumerate(_sheet_rows(df)):
+                    worksheet.write_row(row_num, 0, row)
+        finally:
+            workbook.close()
+        return
+
+    # Fallback: openpyxl's write-only mode streams rows as XML instead of building every cell
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_title, df in sheets:
+        worksheet = workbook.create_sheet(sheet_title)
+        for row in _sheet_rows(df):
+            worksheet.append(row)
+    if not workbook.worksheets:
+        workbook.create_sheet('Sheet1')
+    workbook.save(output_path)
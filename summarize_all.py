@@ -0,0 +1,29 @@
+import sys
+import argparse
+from _aggregate import BASE_FOLDER, FAILED_FILES_LOG, aggregate_all, combine_stages
+from excel_3CNV_analysis import create_stage_summary, save_summaries_to_excel
+from overall_analysis_excel import save_summary_to_excel
+
+# ---- Main ----
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the per-stage and overall ESCC summaries from a single walk.")
+    parser.add_argument('--base-folder', default=BASE_FOLDER)
+    parser.add_argument('--out-stage', help="Per-stage summary workbook (skipped if omitted)")
+    parser.add_argument('--out-overall', help="Overall summary workbook (skipped if omitted)")
+    args = parser.parse_args(argv)
+
+    print("🔎 Starting analysis across all stages in:", args.base_folder)
+    stages = aggregate_all(args.base_folder)
+
+    if args.out_stage:
+        stage_summaries = {stage: create_stage_summary(stage, stage_data) for stage, stage_data in stages.items()}
+        save_summaries_to_excel(stage_summaries, args.out_stage)
+
+    if args.out_overall:
+        combined = combine_stages(stages)
+        save_summary_to_excel(combined['cnv_arr'], combined['gene_counter'], combined['class_counter'], args.out_overall)
+
+    print(f"⚠️ Check '{FAILED_FILES_LOG}' for any problematic files.")
+
+if __name__ == "__main__":
+    sys.exit(main())